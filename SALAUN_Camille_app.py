@@ -1,88 +1,16 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import geopandas as gpd
-import seaborn as sns
-import plotly.express as px
-import altair as alt
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-from datetime import date
-import json
-import folium
-import random
-from shapely.geometry import Polygon, LinearRing, Point, mapping
+from vigicru_data import file_path
+from vigicru_queries import cell_counts, cell_points, merge_cells, merge_counts, merge_unique, rollup, spatial_bins, tile_level
+from vigicru_shared import get_shared_data
+# The charting libraries are imported by the pages that use them, so that the first page is shown sooner.
 
+# The sessions share the same tables (see vigicru_shared.py) : with copy on write, a session modifying a frame
+# it got from them modifies its own copy.
+pd.set_option('mode.copy_on_write', True)
 
-# Path to GeoJSON file
-file_path = 'Projet/InfoVigiCru.geojson'
 
 st.set_page_config(layout='wide', initial_sidebar_state='expanded')
-# Travail sur les coordonnées pour les extraires et pouvoir ainsi les plots dans streamlit :
-# First : transform MULTILINESTINGS into POLIGON type to be able to extract coordinates more easily the coordinates:
-def flatten_coordinates(coords):
-    return [coord for sublist in coords for coord in sublist]
-
-def linestring_to_polygon(gdf):
-    # Convert LineString to Polygon
-    gdf['geometry'] = [Polygon(LinearRing(flatten_coordinates(mapping(x)['coordinates']))) for x in gdf.geometry]
-    return gdf 
-
-# Beggining of the extraction of the coordinates :
-#@st.cache_data()
-def extract_coordinates(geo_data):
-    # Extract coordonnates of geo_dataframe
-    coords_df = geo_data.get_coordinates()
-    # Create a geodf from the coords_df using the coordinates to create Point object:
-    geometry = [Point(xy) for xy in zip(coords_df['x'], coords_df['y'])]
-    gdf_coords = gpd.GeoDataFrame(coords_df, geometry=geometry, crs=geo_data.crs)
-    # Rename column 'geometry' into 'point_geometry'
-    gdf_coords = gdf_coords.rename(columns={'geometry': 'point_geometry'})
-    # Concat gdf_coords with geo_data.
-    result = pd.concat([geo_data, gdf_coords], axis=1)
-    # Reinitialiser
-    result = result.reset_index(drop=True)
-    # Drop non useful columns: 
-    result = result.drop(['point_geometry'], axis = 1)
-    result = result.drop(['geometry'], axis = 1)
-    # Rename col latitude and longitude:
-    result = result.rename(columns={'x':'longitude', 'y':'latitude'})
-    return result
-
-def date_transformation(geo_data):
-    geo_data['DhCEntCru'] = pd.to_datetime(geo_data['DhCEntCru'])
-    geo_data['Year'] = geo_data['DhCEntCru'].dt.year
-    return geo_data
-
-def color_area(geo_data):
-    # Color for the rivier :
-    unique_values_riviere = geo_data['LbEntCru'].unique()
-    color_mapping_riviere = {value: [round(random.uniform(0, 1), 1), round(random.uniform(0, 1), 1), round(random.uniform(0, 1), 1), round(random.uniform(0, 1), 1)] for value in unique_values_riviere}
-    geo_data['Color_riviere'] = geo_data['LbEntCru'].map(color_mapping_riviere)
-    # Color for the rivier basin :
-    unique_values_bassin = geo_data['CdDiEnt_1'].unique()
-    color_mapping_bassin = {value: [round(random.uniform(0, 1), 1), round(random.uniform(0, 1), 1), round(random.uniform(0, 1), 1), round(random.uniform(0, 1), 1)] for value in unique_values_bassin}
-    geo_data['Color_bassin'] = geo_data['CdDiEnt_1'].map(color_mapping_bassin)
-    return geo_data
-
-# Function to clean the dataset (remove duplicates, apply above functions, drop non useful col, create new columns ....)
-#@st.cache_data()
-def clean_data():
-    gdf = gpd.read_file(file_path)
-    gdf = color_area(gdf)
-    geo_data = linestring_to_polygon(gdf)
-    geo_data = geo_data.drop(['TypEntCru'], axis=1)
-    geo_data = geo_data.drop(['StEntCru'], axis=1)
-    geo_data = geo_data.drop(['TypEnSup_1'], axis=1)
-    geo_data = geo_data.dropna()
-    geo_data['DhCEntCru'] = pd.to_datetime(geo_data['DhCEntCru'])
-    geo_data['Year'] = geo_data['DhCEntCru'].dt.year.astype(int)
-    geo_data['Month'] = geo_data['DhCEntCru'].dt.month.astype(int)
-    geo_data_coordinates = extract_coordinates(geo_data)
-    return geo_data_coordinates
-
-# Use geopandas to read the GeoJSON file into a GeoDataFrame
-geo_data = clean_data()
 
 # Creation of the dictionaries containing the data and the corresponding value (name of the place)
 dico_bassin = {
@@ -126,23 +54,43 @@ with st.sidebar:
         st.write("Here is my [linkedin profile](https://www.linkedin.com/in/camille-salaun/)")
         st.write("Efrei Paris - #datavz2023efrei")
 
+# The cleaning of the dataset is done in vigicru_data.py and stored on disk : the GeoJSON is only parsed again when it changes.
+# The table and its index for the filters of the widgets are loaded once by process and shared (read only) by all the
+# sessions, see vigicru_shared.py. The tables used by only one page are computed the first time this page is opened.
+# The tables of the introduction are computed by segment of the index and merged, so the whole table is never built.
+shared_data = get_shared_data(file_path)
+alert_index = shared_data.index
+
+# Points of the maps of the introduction : one point by cell of about 4 pixels (at the zoom of the whole of France) and by color,
+# with the highest level of alert of the cell as size, and at most 20000 points by map.
+intro_map_level = tile_level(6, cell_pixels=4)
+intro_map_level_max = {'NivInfViCr': ('NivInfViCr', 'max')}
+
+def intro_map_points(color_column):
+    cells = shared_data.merged(f'intro_cells_{color_column}',
+                               lambda data: cell_counts(data, intro_map_level, [color_column], **intro_map_level_max),
+                               lambda cells, new_cells: merge_cells(cells, new_cells, [color_column], **intro_map_level_max))
+    return shared_data.derived(f'intro_map_{color_column}', lambda: cell_points(cells, intro_map_level, [color_column], 20000, **intro_map_level_max))
 
 if page == "General introduction":
+    import plotly.express as px
     st.title('Analyse of the flood alert from 2006 to 2023 in France')
     st.title('General introduction - What is the dataset composed of ?')
     st.write('First, lets load our dataset :')
-    st.write(geo_data)
+    # Only the first rows are sent to the browser, the whole table would be several MB.
+    st.write(alert_index.head(1000))
+    st.caption(f'First 1000 rows of {len(alert_index)}.')
     st.write('After having cleaned the dataset, we can see that there are four principal columns that we will use : the LbEntCru column indicating the river name, the DhEntCru column with the dates of the alert (in general equal to the DhMentCru column), the cdensup_1 column indicating the territory, the CdDiEnt_1 indicating the basin, and the NivInfViCr with the alert level.\n',
              'We also created five columns from the data in the dataset : Color_rivier and Color_bassin columns indicating for each river or basin the color that it should have. We also extracted the year and month from the DhEntCru column to simplify our request. Finally, we extracted the latitude and longitude of each points form the geometry column of our dataset to be able to use those points in our modelisations.')
     st.write('Now that we have created all of the necessaries columns, we can finaly start to plot our datas. We will start by a general plot : a map regrouping each of the alert with the color depending on the river name :')
-    st.map(geo_data, 
+    st.map(intro_map_points('Color_riviere'), 
         latitude = 'latitude',
         longitude = 'longitude',
         size = 'NivInfViCr',
         color = 'Color_riviere'
         )
     st.write('Well, there are many color in this map and it is really ugly. Even if this map permit us to see all the river on which an alert was created since 2006, it still is a general and non usefull map. So, let us try another type of map :')
-    st.map(geo_data, 
+    st.map(intro_map_points('Color_bassin'), 
         latitude = 'latitude',
         longitude = 'longitude',
         size = 'NivInfViCr',
@@ -152,7 +100,7 @@ if page == "General introduction":
              'Now, lets see how are the alert divide by bassin :')
     
     # Pie chart of the bassin percentages
-    count_bassin = geo_data['CdDiEnt_1'].value_counts()
+    count_bassin = shared_data.merged('count_bassin', lambda data: data['CdDiEnt_1'].value_counts(), merge_counts)
     bassin_percentage = (count_bassin/count_bassin.sum())*100
     labels = [dico_bassin.get(key, key) for key in bassin_percentage.index]
     fig = px.pie(values = bassin_percentage, names=labels, title='Repartition of the flood alerts by river basin')
@@ -162,8 +110,9 @@ if page == "General introduction":
 
     st.write('Lets see if the number of alert by basin is related to its number of river :')
     # Pie chart of the percentage of total rivier by bassin
-    unique_rivers_by_basin = geo_data.groupby('CdDiEnt_1')['LbEntCru'].nunique().reset_index()
-    unique_rivers_by_basin.columns = ['CdDiEnt_1', 'Unique_River_Count']
+    # The (basin, river) pairs are merged, the rivers of a basin can come from several segments.
+    rivers_by_basin = shared_data.merged('rivers_by_basin', lambda data: data[['CdDiEnt_1', 'LbEntCru']].drop_duplicates(), merge_unique)
+    unique_rivers_by_basin = rivers_by_basin.groupby('CdDiEnt_1', observed=True)['LbEntCru'].nunique().reset_index(name='Unique_River_Count')
     riviere_bassin_percentage = (unique_rivers_by_basin['Unique_River_Count'] / unique_rivers_by_basin['Unique_River_Count'].sum()) * 100
     labels = [dico_bassin.get(key, key) for key in unique_rivers_by_basin['CdDiEnt_1']]
     fig = px.pie(names=labels, values=riviere_bassin_percentage, title='Repartition of Unique Rivers by River Basin')
@@ -172,6 +121,8 @@ if page == "General introduction":
     st.write('So we can see that the number of alert by basin is related to the number of river in it, wich is pretty logical (the more river ther is in a basin, the more likely an alert will appear). But even so, the basin with the most alert, so thoose that need a particular attention are the following : Adour-Garonne, Loire-Bretagne, Seine-Normandie and Rhône-Mediterranée.')
 
 elif page == "Analyse of the alert":
+    import altair as alt
+    alert_cube_data = shared_data.cube
     st.title('Analyse of the flood alert from 2006 to 2023 in France')
     st.title('Analyse of the alert by year, month and type')
 
@@ -180,10 +131,10 @@ elif page == "Analyse of the alert":
     st.write('First, lets us analyse the repartition of the alert by revier and by level of alert :')
     select_values_bar = st.selectbox('Select a river basin :', list(dico_bassin.values())) 
     select_bassin_bar = {k for k,v in dico_bassin.items() if v == select_values_bar}
-    filtered_bar = geo_data[geo_data['CdDiEnt_1'].isin(select_bassin_bar)]
+    filtered_bar = rollup(alert_cube_data, ['LbEntCru', 'NivInfViCr'], CdDiEnt_1=select_bassin_bar)
     bar_chart = alt.Chart(filtered_bar, title ='Repartition of the alert by river name and level').mark_bar().encode(
         x = alt.X("LbEntCru:N", title="River Name"),
-        y = alt.Y("count():Q", title ="Number of alerts"),
+        y = alt.Y("Count:Q", title ="Number of alerts"),
         color = alt.Color("NivInfViCr:N")
     )
     bar_chart = bar_chart.properties(
@@ -199,11 +150,11 @@ elif page == "Analyse of the alert":
     year_range = (2006, 2023)
     selected_year_bar2 = st.slider('Select a year :', min_value=year_range[0], max_value=year_range[1], value=year_range[0], key="slider_1") 
 
-    filtered_date_bar = geo_data[geo_data['Year'] == selected_year_bar2]
+    filtered_date_bar = rollup(alert_cube_data, ['NivInfViCr'], Year=selected_year_bar2)
 
     bar_chart2 = alt.Chart(filtered_date_bar).mark_bar().encode(
         x = alt.X("NivInfViCr:N", title="Type of alert"),
-        y = alt.Y("count():Q", title ="Number of occurences")
+        y = alt.Y("Count:Q", title ="Number of occurences")
     )
     bar_chart2 = bar_chart2.properties(
         width=600,
@@ -214,9 +165,12 @@ elif page == "Analyse of the alert":
 
     # Bar plot of the count of alerts by months:
     st.write('Lets now see which months regrouped the more alert:')
-    bar_chart3 = alt.Chart(geo_data).mark_bar().encode(
+    month_bar = rollup(alert_cube_data, ['Month', 'NivInfViCr'])
+    # A date in the month is enough for the month() time unit of the x axis.
+    month_bar['DhCEntCru'] = pd.to_datetime(dict(year=2000, month=month_bar['Month'], day=1))
+    bar_chart3 = alt.Chart(month_bar).mark_bar().encode(
         x=alt.X("month(DhCEntCru):T", title="Month", axis=alt.Axis(format="%B")),
-        y=alt.Y("count():Q", title="Number of alerts"),
+        y=alt.Y("Count:Q", title="Number of alerts"),
         color=alt.Color("NivInfViCr:N")
     )
     bar_chart3 = bar_chart3.properties(
@@ -234,10 +188,10 @@ elif page == "Analyse of the alert":
     # We need to transform select_territoire_line into a string without the {} and with single quote :
     select_territoire_line_str = ', '.join(f'{str(item)}' for item in select_territoire_line)
 
-    filtered_line = geo_data.loc[geo_data['cdensup_1'] == select_territoire_line_str]
+    filtered_line = rollup(alert_cube_data, ['Year'], cdensup_1=select_territoire_line_str)
     line_chart = alt.Chart(filtered_line, title = 'Line plot of the number of alert by territory in function of the years').mark_line().encode(
-        x= alt.X("year(DhCEntCru):O", title="Years"),
-        y = "count():Q",
+        x= alt.X("Year:O", title="Years"),
+        y = "Count:Q",
         #color = alt.Color('LbEntCru:N')
     ).properties(
         width=600,
@@ -247,20 +201,25 @@ elif page == "Analyse of the alert":
     st.write('Thanks to this graph, we were able to see that : in general, many alert were count in 2006 as well as in 2013 and 2020. In 2013, many alert were noted in the Maine-Loire Aval territory while in 2020 it was in Méditerranée Ouest, Seine Moyenne and Maine-Loire aval. In 2021, the territories Rhin Sarre and Mediterranée est were the one with the most alert. Finally, in general, Vilaine-Côtière Bretons and Seine amont-Marne amont are the territory with a constant count of alert (maybe because there is no larte for the years between 2006 and 2020).')
 
 elif page == "General map":
+    import plotly.graph_objects as go
     st.title('Analyse of the flood alert from 2006 to 2023 in France')
     st.title('General map')
     st.write('Here is a general map of the alert in function of their level and the year :')
     # Intercative map by year and riviere :
     year_range = (2006, 2023)
     selected_year_map2 = st.slider('Select a year :', min_value=year_range[0], max_value=year_range[1], value=year_range[0], key="slider_3") 
-    select_level_map2 = st.selectbox('Select a level of alert :', geo_data['NivInfViCr'].unique(), key="box_3")
+    select_level_map2 = st.selectbox('Select a level of alert :', list(alert_index.categories['NivInfViCr']), key="box_3")
+    zoom_map2 = st.slider('Zoom :', min_value=4, max_value=12, value=5, key="zoom_3")
 
-    filtered_line_map2 = geo_data.loc[(geo_data['NivInfViCr'] == select_level_map2) & (geo_data['Year'] == selected_year_map2)]
+    filtered_line_map2 = alert_index.select(NivInfViCr=select_level_map2, Year=selected_year_map2)
     center_lat2 = filtered_line_map2['latitude'].mean()
     center_lon2 = filtered_line_map2['longitude'].mean()
+    # The points are counted by cells of about one pixel at the chosen zoom, each cell being weighted by its count.
+    cells_map2 = spatial_bins(filtered_line_map2, zoom_map2)
     fig2 = go.Figure(go.Densitymapbox(
-                        lat=filtered_line_map2['latitude'], 
-                        lon=filtered_line_map2['longitude'],
+                        lat=cells_map2['latitude'], 
+                        lon=cells_map2['longitude'],
+                        z=cells_map2['Count'],
                         radius=1,
                         colorscale="Viridis",
                     ))
@@ -268,7 +227,7 @@ elif page == "General map":
     fig2.update_layout(
         mapbox_style="stamen-terrain", 
         mapbox_center={"lat": center_lat2, "lon": center_lon2}, 
-        mapbox_zoom=5,
+        mapbox_zoom=zoom_map2,
         )
 
     fig2.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
@@ -278,6 +237,7 @@ elif page == "General map":
 
 
 elif page == "Map by territory":
+    import plotly.graph_objects as go
     st.title('Analyse of the flood alert from 2006 to 2023 in France')
     st.title('Map by territory and by year')
     st.write('This map will permit to visualize what we saw earlier in the analyse of the alerts part:')
@@ -287,13 +247,16 @@ elif page == "Map by territory":
     select_territoire_char_map1 = st.selectbox('Select a territory :', list(dico_territoire1.values()), key="box_2") 
     select_territoire_line_map1 = {k for k,v in dico_territoire1.items() if v == select_territoire_char_map1 }
     select_territoire_line_str_map1 = ', '.join(f'{str(item)}' for item in select_territoire_line_map1)
+    zoom_map1 = st.slider('Zoom :', min_value=4, max_value=12, value=7, key="zoom_2")
 
-    filtered_line_map = geo_data.loc[(geo_data['cdensup_1'] == select_territoire_line_str_map1) & (geo_data['Year'] == selected_year_map1)]
+    filtered_line_map = alert_index.select(cdensup_1=select_territoire_line_str_map1, Year=selected_year_map1)
     center_lat = filtered_line_map['latitude'].mean()
     center_lon = filtered_line_map['longitude'].mean()
+    cells_map1 = spatial_bins(filtered_line_map, zoom_map1)
     fig1 = go.Figure(go.Densitymapbox(
-                        lat=filtered_line_map['latitude'], 
-                        lon=filtered_line_map['longitude'],
+                        lat=cells_map1['latitude'], 
+                        lon=cells_map1['longitude'],
+                        z=cells_map1['Count'],
                         radius=1,
                         colorscale="Viridis",
                     ))
@@ -301,7 +264,7 @@ elif page == "Map by territory":
     fig1.update_layout(
         mapbox_style="stamen-terrain", 
         mapbox_center={"lat": center_lat, "lon": center_lon}, 
-        mapbox_zoom=7,
+        mapbox_zoom=zoom_map1,
         )
     fig1.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
     st.plotly_chart(fig1)
@@ -0,0 +1,183 @@
+# Benchmark of the load and of the pages of the dashboard on synthetic datasets.
+# For each size of dataset (compared to the production file), it measures the wall time and the memory of each step
+# of clean_data(), of the cache and of the shared data, then runs each page of
+# the app headlessly (streamlit AppTest) and measures its time and the size of each figure sent to the browser.
+# The memory is measured three ways : tracemalloc only sees the allocations of Python, so the growth of the memory of
+# Arrow and of the RSS of the process (which includes GDAL and the pages of the memory-mapped cache) is also recorded.
+# The peak RSS is the high-water mark of the process : it only grows when a step goes beyond the previous steps.
+# The results are saved as json to follow the regressions over time.
+#   python -m benchmarks.bench_dashboard --scales 1 10 100
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import shapely
+
+import vigicru_data
+import vigicru_shared
+from benchmarks.synthetic import production_features, synthetic_geo_data, write_geojson
+from vigicru_data import color_area, compact_geo_data, date_transformation, drop_columns, extract_coordinates, load_clean_data, update_cache
+from vigicru_queries import AlertIndex, alert_cube
+from vigicru_shared import rss_bytes
+
+
+app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SALAUN_Camille_app.py')
+pages = ["General introduction", "Analyse of the alert", "General map", "Map by territory"]
+# Elements of the page that carry data to the browser.
+figure_types = {'plotly_chart', 'vega_lite_chart', 'arrow_vega_lite_chart', 'deck_gl_json_chart', 'arrow_data_frame', 'dataframe', 'table'}
+
+
+def max_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+@contextmanager
+def measure(results, name, trace_memory=True):
+    if trace_memory:
+        tracemalloc.start()
+    arrow, rss, max_rss = pa.total_allocated_bytes(), rss_bytes(), max_rss_bytes()
+    start = time.perf_counter()
+    entry = {}
+    results[name] = entry
+    try:
+        yield entry
+    finally:
+        entry['seconds'] = time.perf_counter() - start
+        if trace_memory:
+            entry['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        entry['arrow_growth_bytes'] = pa.total_allocated_bytes() - arrow
+        entry['rss_growth_bytes'] = rss_bytes() - rss
+        entry['peak_rss_growth_bytes'] = max_rss_bytes() - max_rss
+
+# Same steps as clean_geo_data(), timed one by one.
+def bench_stages(path, trace_memory):
+    stages = {}
+    with measure(stages, 'read_file', trace_memory):
+        geo_data = gpd.read_file(path)
+    with measure(stages, 'color_area', trace_memory):
+        geo_data = color_area(geo_data)
+    with measure(stages, 'drop_columns', trace_memory):
+        geo_data = drop_columns(geo_data)
+    with measure(stages, 'date_transformation', trace_memory):
+        geo_data = date_transformation(geo_data)
+    with measure(stages, 'extract_coordinates', trace_memory):
+        geo_data = extract_coordinates(geo_data)
+    with measure(stages, 'compact_geo_data', trace_memory):
+        geo_data = compact_geo_data(geo_data)
+    points = len(geo_data)
+    del geo_data
+    with measure(stages, 'build_cache', trace_memory):
+        update_cache(path)
+    with measure(stages, 'load_cache', trace_memory):
+        geo_data = load_clean_data(path)
+    with measure(stages, 'alert_index', trace_memory):
+        AlertIndex(geo_data)
+    with measure(stages, 'alert_cube', trace_memory):
+        alert_cube(geo_data)
+    return stages, points
+
+def walk(node):
+    children = getattr(node, 'children', None) or {}
+    for child in (children.values() if isinstance(children, dict) else children):
+        yield child
+        yield from walk(child)
+
+def bench_pages(trace_memory, timeout):
+    from streamlit.testing.v1 import AppTest
+    results = {}
+    vigicru_shared._shared.clear()
+    for page in pages:
+        # The app always starts on the first page, the first run of all also loads the shared data in the process.
+        app = AppTest.from_file(app_path, default_timeout=timeout)
+        if page == pages[0]:
+            with measure(results, 'cold start', trace_memory):
+                app.run()
+        else:
+            app.run()
+        # Opening of the page from the sidebar.
+        with measure(results, page, trace_memory) as entry:
+            if page == pages[0]:
+                app.run()
+            else:
+                app.sidebar.selectbox[0].select(page).run()
+        if app.exception:
+            raise RuntimeError(f'{page} : {app.exception[0].message}')
+        entry['figures'] = [
+            {'type': element.type, 'bytes': element.proto.ByteSize()}
+            for element in walk(app._tree) if getattr(element, 'type', None) in figure_types
+        ]
+        entry['payload_bytes'] = sum(figure['bytes'] for figure in entry['figures'])
+    return results
+
+def bench_scale(scale, trace_memory, with_pages, timeout):
+    features = int(production_features * scale)
+    result = {'scale': scale, 'features': features}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            # Same layout as the project, the app reads Projet/InfoVigiCru.geojson.
+            os.makedirs(os.path.dirname(vigicru_data.file_path))
+            write_geojson(synthetic_geo_data(features), vigicru_data.file_path)
+            result['file_bytes'] = os.path.getsize(vigicru_data.file_path)
+            result['stages'], result['points'] = bench_stages(vigicru_data.file_path, trace_memory)
+            if with_pages:
+                result['pages'] = bench_pages(trace_memory, timeout)
+        finally:
+            os.chdir(cwd)
+            vigicru_shared._shared.clear()
+    return result
+
+def print_result(result):
+    print(f"scale {result['scale']} : {result['features']} features, {result['points']} points, {result['file_bytes'] / 2**20:.1f} MiB of GeoJSON")
+    for group in ['stages', 'pages']:
+        for name, entry in result.get(group, {}).items():
+            line = f"  {name:<40} {entry['seconds']:8.3f} s"
+            if 'peak_bytes' in entry:
+                line += f"  {entry['peak_bytes'] / 2**20:9.1f} MiB peak"
+            line += f"  {entry['rss_growth_bytes'] / 2**20:+9.1f} MiB RSS ({entry['peak_rss_growth_bytes'] / 2**20:+.1f} peak)  {entry['arrow_growth_bytes'] / 2**20:+9.1f} MiB Arrow"
+            if 'payload_bytes' in entry:
+                line += f"  {entry['payload_bytes'] / 2**10:9.1f} KiB sent"
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100], help='sizes of the datasets compared to the production file')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the memory (tracemalloc slows down the code)')
+    parser.add_argument('--no-pages', action='store_true', help='only measure the load of the data')
+    parser.add_argument('--timeout', type=float, default=600, help='timeout of a run of the app, in seconds')
+    parser.add_argument('--output', default=None, help='json file of the results (default: benchmarks/results/dashboard-<date>.json)')
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', f"dashboard-{datetime.now():%Y%m%d-%H%M%S}.json")
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'versions': {'pandas': pd.__version__, 'geopandas': gpd.__version__, 'shapely': shapely.__version__},
+        'results': [],
+    }
+    for scale in args.scales:
+        result = bench_scale(scale, not args.no_memory, not args.no_pages, args.timeout)
+        print_result(result)
+        report['results'].append(result)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f'results saved in {output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Benchmark of the coordinate extraction : the former Polygon/Point loops against the vectorized shapely 2 path.
+#   python -m benchmarks.bench_geometry --scale 10
+import argparse
+import time
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Polygon, LinearRing, Point, mapping
+
+from benchmarks.synthetic import production_features, synthetic_geo_data
+from vigicru_data import extract_coordinates
+
+
+# Former implementation (one Polygon by feature and one Point by vertex), kept here as the reference.
+def flatten_coordinates(coords):
+    return [coord for sublist in coords for coord in sublist]
+
+def legacy_linestring_to_polygon(gdf):
+    gdf['geometry'] = [Polygon(LinearRing(flatten_coordinates(mapping(x)['coordinates']))) for x in gdf.geometry]
+    return gdf
+
+def legacy_extract_coordinates(geo_data):
+    coords_df = geo_data.get_coordinates()
+    geometry = [Point(xy) for xy in zip(coords_df['x'], coords_df['y'])]
+    gdf_coords = gpd.GeoDataFrame(coords_df, geometry=geometry, crs=geo_data.crs)
+    gdf_coords = gdf_coords.rename(columns={'geometry': 'point_geometry'})
+    # pd.concat(axis=1) refuses the repeated index of get_coordinates() with recent pandas, join does the same explode.
+    result = pd.DataFrame(geo_data).join(gdf_coords)
+    result = result.reset_index(drop=True)
+    result = result.drop(['point_geometry'], axis = 1)
+    result = result.drop(['geometry'], axis = 1)
+    result = result.rename(columns={'x':'longitude', 'y':'latitude'})
+    return result
+
+def legacy(geo_data):
+    return legacy_extract_coordinates(legacy_linestring_to_polygon(geo_data))
+
+def timed(function, geo_data, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        data = geo_data.copy()
+        start = time.perf_counter()
+        result = function(data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=10, help='size of the dataset compared to the production file')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    geo_data = synthetic_geo_data(int(production_features * args.scale))
+    print(f'{len(geo_data)} features')
+    legacy_time, expected = timed(legacy, geo_data, args.repeat)
+    vectorized_time, result = timed(extract_coordinates, geo_data, args.repeat)
+    pd.testing.assert_frame_equal(result, expected)
+    print(f'{len(result)} points')
+    print(f'legacy      : {legacy_time:.3f} s')
+    print(f'vectorized  : {vectorized_time:.3f} s  (x{legacy_time / vectorized_time:.1f})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Memory footprint of the cleaned table : former layout (object labels, lists of colors, 64 bits numbers)
+# against the compact one written by clean_data().
+#   python -m benchmarks.bench_memory --scale 1
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import production_features, synthetic_geo_data
+from vigicru_data import clean_geo_data
+
+
+# Rebuild the layout the table had before compact_geo_data().
+def former_layout(geo_data):
+    former = geo_data.copy()
+    for column in former.columns:
+        if isinstance(former[column].dtype, pd.CategoricalDtype):
+            former[column] = former[column].astype(object)
+        elif former[column].dtype.kind == 'f':
+            former[column] = former[column].astype(np.float64)
+        elif former[column].dtype.kind == 'i':
+            former[column] = former[column].astype(np.int64)
+    for column in ['Color_riviere', 'Color_bassin']:
+        # One list by river or basin, shared by its rows like with the former .map() of color_area().
+        lists = {color: [int(color[i:i + 2], 16) / 255 for i in range(1, 9, 2)] for color in former[column].unique()}
+        former[column] = former[column].map(lists)
+    return former
+
+# Bytes used by a column. For object columns, pandas counts a shared Python object once by row,
+# here each object (and the floats of the color lists) is counted once, plus one pointer by row.
+def column_bytes(series):
+    if series.dtype != object:
+        return series.memory_usage(deep=True, index=False)
+    seen, size = set(), 8 * len(series)
+    for value in series:
+        if id(value) not in seen:
+            seen.add(id(value))
+            size += sys.getsizeof(value)
+            if isinstance(value, list):
+                size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+def memory_report(before, after):
+    report = pd.DataFrame({
+        'before': {column: column_bytes(before[column]) for column in before.columns},
+        'after': {column: column_bytes(after[column]) for column in after.columns},
+        'dtype': after.dtypes.astype(str),
+    })
+    report.loc['total'] = [report['before'].sum(), report['after'].sum(), '']
+    report['ratio'] = report['before'] / report['after']
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=1, help='size of the dataset compared to the production file')
+    args = parser.parse_args()
+
+    after = clean_geo_data(synthetic_geo_data(int(production_features * args.scale)))
+    before = former_layout(after)
+    report = memory_report(before, after)
+    print(f'{len(after)} points')
+    with pd.option_context('display.float_format', '{:.1f}'.format):
+        print(report.assign(before=report['before'] / 2**20, after=report['after'] / 2**20).rename(columns={'before': 'before (MiB)', 'after': 'after (MiB)'}))
+
+if __name__ == '__main__':
+    main()
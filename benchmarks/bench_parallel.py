@@ -0,0 +1,54 @@
+# Scaling of the parallel cleaning : clean_geo_data() against clean_geo_data_parallel() with 1 to N processes.
+# Each parallel result is checked to be the same table as the serial one, also on a table with sparse categories.
+#   python -m benchmarks.bench_parallel --scale 10 --workers 1 2 4 8
+import argparse
+import os
+import time
+
+import pandas as pd
+
+import vigicru_data
+from benchmarks.synthetic import production_features, synthetic_geo_data
+from vigicru_data import clean_geo_data, clean_geo_data_parallel
+
+
+def timed(function, geo_data, repeat, *args):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        data = geo_data.copy()
+        start = time.perf_counter()
+        result = function(data, None, *args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+# Check on a table where each river only has a few features : the partitions have different categories, which must
+# be merged in the order of the serial path (with the default data, every partition has every river).
+def check_sparse_categories(workers):
+    geo_data = synthetic_geo_data(12000, n_rivers=20000, seed=1)
+    vigicru_data.parallel_min_features = min(vigicru_data.parallel_min_features, len(geo_data) // workers)
+    pd.testing.assert_frame_equal(clean_geo_data_parallel(geo_data.copy(), None, workers), clean_geo_data(geo_data.copy()))
+    print(f'sparse rivers : same table as the serial path with {workers} workers')
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=10, help='size of the dataset compared to the production file')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, cpus}), help='numbers of processes to measure')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    geo_data = synthetic_geo_data(int(production_features * args.scale))
+    print(f'{len(geo_data)} features, {cpus} CPUs')
+    serial_time, expected = timed(clean_geo_data, geo_data, args.repeat)
+    print(f'{len(expected)} points')
+    print(f'serial        : {serial_time:.3f} s')
+    # Also split the small datasets, to measure the cost of the processes.
+    vigicru_data.parallel_min_features = min(vigicru_data.parallel_min_features, len(geo_data) // max(args.workers))
+    for workers in args.workers:
+        parallel_time, result = timed(clean_geo_data_parallel, geo_data, args.repeat, workers)
+        pd.testing.assert_frame_equal(result, expected)
+        print(f'{workers:3d} workers   : {parallel_time:.3f} s  (x{serial_time / parallel_time:.2f})')
+    check_sparse_categories(max(max(args.workers), 3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Resident memory of one worker serving concurrent viewers with the shared dataset.
+# Each simulated session loads the data (all at the same time for the first request), then moves the sliders of the
+# pages and keeps its last results, like a browser session keeps its figures. The command fails when the RSS of the
+# worker goes above --max-rss-mb, to be used as a memory cap in the deployment checks.
+#   python -m benchmarks.bench_sessions --sessions 50 --max-rss-mb 1024
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import production_features, synthetic_geo_data, write_geojson
+from vigicru_queries import rollup
+from vigicru_shared import get_shared_data, rss_bytes
+
+
+def session(path, directory, start, results, number):
+    start.wait()
+    shared = get_shared_data(path, directory)
+    kept = []
+    for year in range(2006, 2024):
+        kept = [
+            shared.index.select(Year=year, NivInfViCr=1),
+            shared.index.select(Year=year, cdensup_1='30'),
+            rollup(shared.cube, ['NivInfViCr'], Year=year),
+        ]
+    results[number] = (shared, kept)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=1, help='size of the dataset compared to the production file')
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--max-rss-mb', type=float, default=None)
+    args = parser.parse_args()
+
+    # Same pandas mode as the app.
+    pd.set_option('mode.copy_on_write', True)
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_geojson(synthetic_geo_data(int(production_features * args.scale)), os.path.join(directory, 'InfoVigiCru.geojson'))
+        get_shared_data(path, directory)  # build the Feather cache, as the preprocessing would
+        import vigicru_shared
+        vigicru_shared._shared.clear()
+        rss_start = rss_bytes()
+
+        start, results = threading.Barrier(args.sessions), [None] * args.sessions
+        threads = [threading.Thread(target=session, args=(path, directory, start, results, i)) for i in range(args.sessions)]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - begin
+        rss_end = rss_bytes()
+
+    loads = len({id(shared) for shared, _ in results})
+    print(f'{len(results[0][0].index)} points, {args.sessions} sessions in {elapsed:.2f} s')
+    print(f'datasets loaded : {loads}')
+    print(f'RSS before : {rss_start / 2**20:.1f} MiB')
+    print(f'RSS after  : {rss_end / 2**20:.1f} MiB ({(rss_end - rss_start) / 2**20 / args.sessions:.2f} MiB by session)')
+    if loads != 1:
+        sys.exit('the dataset was loaded more than once')
+    if args.max_rss_mb is not None and rss_end > args.max_rss_mb * 2**20:
+        sys.exit(f'RSS above the cap of {args.max_rss_mb} MiB')
+
+if __name__ == '__main__':
+    main()
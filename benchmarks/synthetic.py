@@ -0,0 +1,44 @@
+# Synthetic datasets with the same shape as Projet/InfoVigiCru.geojson, used by the benchmarks.
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+# Approximate size of the production file (number of alert features and vertices by line).
+production_features = 20000
+bassins = ['FRF', 'EU35', 'FRG', 'EU31', 'EU36', 'EU3', 'EU33', 'FRL']
+territoires = [30, 32, 31, 25, 18, 20, 29, 4, 2, 7, 21, 3, 9, 8, 19, 6, 22, 26]
+
+
+def synthetic_geo_data(n_features=production_features, n_rivers=400, max_lines=3, max_vertices=12, seed=0):
+    rng = np.random.default_rng(seed)
+    # Number of lines by feature and of vertices by line :
+    lines_by_feature = rng.integers(1, max_lines + 1, n_features)
+    n_lines = lines_by_feature.sum()
+    vertices_by_line = rng.integers(3, max_vertices + 1, n_lines)
+    n_vertices = vertices_by_line.sum()
+    # Each line is a small random walk starting somewhere in metropolitan France.
+    line_of_vertex = np.repeat(np.arange(n_lines), vertices_by_line)
+    start = np.column_stack([rng.uniform(-4.5, 7.5, n_lines), rng.uniform(42.5, 51, n_lines)])
+    steps = rng.normal(0, 0.01, (n_vertices, 2))
+    coords = start[line_of_vertex] + steps.cumsum(axis=0) - np.repeat(steps.cumsum(axis=0)[np.r_[0, vertices_by_line.cumsum()[:-1]]], vertices_by_line, axis=0)
+    lines = shapely.linestrings(coords, indices=line_of_vertex)
+    geometry = shapely.multilinestrings(lines, indices=np.repeat(np.arange(n_features), lines_by_feature))
+
+    river = rng.integers(0, n_rivers, n_features)
+    dates = pd.Timestamp('2006-01-01') + pd.to_timedelta(rng.integers(0, 18 * 365 * 24, n_features), unit='h')
+    return gpd.GeoDataFrame({
+        'LbEntCru': np.array([f'Rivière {i}' for i in range(n_rivers)], dtype=object)[river],
+        'DhCEntCru': dates.strftime('%Y-%m-%dT%H:%M:%S').to_numpy(dtype=object),
+        'cdensup_1': np.array([str(t) for t in territoires], dtype=object)[river % len(territoires)],
+        'CdDiEnt_1': np.array(bassins, dtype=object)[river % len(bassins)],
+        'NivInfViCr': rng.choice([1, 2], n_features, p=[0.97, 0.03]),
+        'TypEntCru': 'TronconVigilance',
+        'StEntCru': 'EnService',
+        'TypEnSup_1': 'TerEntVigiCru',
+    }, geometry=geometry, crs='EPSG:4326')
+
+def write_geojson(geo_data, path):
+    geo_data.to_file(path, driver='GeoJSON')
+    return path
@@ -0,0 +1,404 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+import shapely
+# geopandas and pyogrio are imported by the functions reading the GeoJSON : the app only reads the cache.
+
+
+# Path to GeoJSON file
+file_path = 'Projet/InfoVigiCru.geojson'
+# Folder where the cleaned dataset is stored once it has been computed
+cache_dir = 'Projet/cache'
+# Version of the layout of the cached table, to increase when clean_data() changes its output
+cache_format = 6
+
+
+# Travail sur les coordonnées pour les extraires et pouvoir ainsi les plots dans streamlit :
+# Each MULTILINESTRING was first converted into a POLYGON to extract its coordinates, which only joins the lines
+# end to end and closes the ring. The same points are read here directly from the geometry array with shapely 2,
+# without creating any Polygon or Point object.
+def coordinate_arrays(geometry):
+    # Flat arrays of all the vertices and the position of the feature they come from.
+    coords, feature_index = shapely.get_coordinates(np.asarray(geometry), return_index=True)
+    if len(coords) == 0:
+        return coords[:, 0], coords[:, 1], feature_index
+    # First and last vertex of each feature :
+    starts = np.flatnonzero(np.r_[True, feature_index[1:] != feature_index[:-1]])
+    ends = np.r_[starts[1:], len(coords)]
+    # Close the ring (like LinearRing does) when the last vertex is not equal to the first one.
+    not_closed = (coords[starts] != coords[ends - 1]).any(axis=1)
+    coords = np.insert(coords, ends[not_closed], coords[starts[not_closed]], axis=0)
+    feature_index = np.insert(feature_index, ends[not_closed], feature_index[starts[not_closed]])
+    return coords[:, 0], coords[:, 1], feature_index
+
+# Beggining of the extraction of the coordinates : one row by point, with the columns of its feature.
+def extract_coordinates(geo_data):
+    longitude, latitude, feature_index = coordinate_arrays(geo_data.geometry.values)
+    result = pd.DataFrame(geo_data.drop(['geometry'], axis=1)).iloc[feature_index]
+    # Reinitialiser
+    result = result.reset_index(drop=True)
+    result['longitude'] = longitude
+    result['latitude'] = latitude
+    return result
+
+def drop_columns(geo_data):
+    geo_data = geo_data.drop(['TypEntCru'], axis=1)
+    geo_data = geo_data.drop(['StEntCru'], axis=1)
+    geo_data = geo_data.drop(['TypEnSup_1'], axis=1)
+    return geo_data.dropna()
+
+def date_transformation(geo_data):
+    geo_data['DhCEntCru'] = pd.to_datetime(geo_data['DhCEntCru'])
+    geo_data['Year'] = geo_data['DhCEntCru'].dt.year.astype(int)
+    geo_data['Month'] = geo_data['DhCEntCru'].dt.month.astype(int)
+    return geo_data
+
+# Colors are written as '#rrggbbaa' strings : with a categorical column, each row only keeps the index of its color in the palette.
+# The random generator is seeded by the value, so a river or a basin always gets the same color, whatever the order
+# of the features or the process that cleans them.
+def random_color(value, seed=0):
+    generator = random.Random(f'{seed}:{value}')
+    return '#' + ''.join(f'{round(round(generator.uniform(0, 1), 1) * 255):02x}' for _ in range(4))
+
+# Color of each river and basin of the table. The colors already given can be passed in `palettes` (they are kept
+# and the new values are added to it), so that the data added later keeps the same colors.
+color_sources = {'Color_riviere': 'LbEntCru', 'Color_bassin': 'CdDiEnt_1'}
+
+def color_palettes(geo_data, palettes=None):
+    palettes = {} if palettes is None else palettes
+    for color_column, column in color_sources.items():
+        palette = palettes.setdefault(color_column, {})
+        for value in geo_data[column].dropna().unique():
+            palette.setdefault(value, random_color(value))
+    return palettes
+
+def color_area(geo_data, palettes=None):
+    palettes = color_palettes(geo_data, palettes)
+    # Color for the rivier and for the rivier basin :
+    for color_column, column in color_sources.items():
+        geo_data[color_column] = geo_data[column].map(palettes[color_column])
+    return geo_data
+
+# Compact representation of the exploded table : the labels and colors repeated on every point become categories,
+# the coordinates float32 (about 1 m of precision) and the year, month and level small integers.
+category_columns = ['LbEntCru', 'CdDiEnt_1', 'cdensup_1', 'Color_riviere', 'Color_bassin']
+compact_dtypes = {'longitude': 'float32', 'latitude': 'float32', 'Year': 'int16', 'Month': 'int8', 'NivInfViCr': 'int8'}
+
+def compact_geo_data(geo_data):
+    dtypes = {column: 'category' for column in category_columns if column in geo_data}
+    dtypes.update({column: dtype for column, dtype in compact_dtypes.items() if column in geo_data})
+    # The other text columns of the file are also stored as categories when their values are repeated.
+    for column in geo_data.columns.difference(list(dtypes)):
+        if geo_data[column].dtype == object and geo_data[column].nunique() < len(geo_data) / 2:
+            dtypes[column] = 'category'
+    return geo_data.astype(dtypes)
+
+# Concatenate cleaned tables : the categories of each column are merged so that the columns stay categorical.
+def concat_geo_data(frames):
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    frames = [frame.copy() for frame in frames]
+    for column in frames[0].columns:
+        if any(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = union_categoricals([frame[column].astype('category').array for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].astype(pd.CategoricalDtype(categories))
+    return pd.concat(frames, ignore_index=True)
+
+# Function to clean the dataset (remove duplicates, apply above functions, drop non useful col, create new columns ....)
+def clean_data(path=file_path, palettes=None):
+    import geopandas as gpd
+    return clean_geo_data(gpd.read_file(path), palettes)
+
+def clean_geo_data(gdf, palettes=None):
+    # The steps are timed one by one in benchmarks/bench_dashboard.py, keep it in sync.
+    geo_data = color_area(gdf, palettes)
+    geo_data = drop_columns(geo_data)
+    geo_data = date_transformation(geo_data)
+    geo_data_coordinates = extract_coordinates(geo_data)
+    return compact_geo_data(geo_data_coordinates)
+
+# Parallel cleaning :
+# The features are split in `workers` contiguous partitions cleaned by a pool of processes, and the cleaned partitions
+# are concatenated in the order of the features. The palettes are filled before the split, so every process gives
+# the same colors, and join_partitions() chooses the categories as the serial path does : the result is the same
+# table as clean_geo_data().
+# Below `parallel_min_features` features by partition, starting the processes costs more than it saves.
+parallel_min_features = 5000
+
+def join_partitions(frames):
+    if len(frames) == 1:
+        return frames[0]
+    geo_data = concat_geo_data(frames)
+    # A column can be a category in a partition and not in another one, or have its categories in another order.
+    for column in geo_data.columns:
+        values = geo_data[column]
+        if values.dtype != object and not isinstance(values.dtype, pd.CategoricalDtype):
+            continue
+        if column in category_columns or values.nunique() < len(geo_data) / 2:
+            # astype() would keep the order of the categories : the unordered dtypes with the same categories are equal.
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.remove_unused_categories()
+                geo_data[column] = values.cat.set_categories(values.cat.categories.sort_values())
+            else:
+                geo_data[column] = values.astype(pd.CategoricalDtype(pd.Index(values.dropna().unique()).sort_values()))
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            geo_data[column] = values.astype(object)
+    return geo_data
+
+def clean_geo_data_parallel(gdf, palettes=None, workers=None):
+    workers = os.cpu_count() if workers is None else workers
+    partitions = min(workers, len(gdf) // parallel_min_features)
+    if partitions <= 1:
+        return clean_geo_data(gdf, palettes)
+    palettes = color_palettes(gdf, palettes)
+    bounds = np.linspace(0, len(gdf), partitions + 1).astype(int)
+    parts = (gdf.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]))
+    with ProcessPoolExecutor(partitions) as executor:
+        frames = list(executor.map(clean_geo_data, parts, repeat(palettes)))
+    return join_partitions(frames)
+
+
+# Cache of the cleaned dataset :
+# The cleaned and exploded table is written once in Feather (Arrow) files next to the GeoJSON and read back with
+# a memory map. A small json file keeps the mtime, size and sha256 of the GeoJSON used to build it, so the cache
+# is rebuilt automatically when the source file changes.
+# The tables are written in the order of the index of the app and read back without copy : the columns of the frames
+# point into the memory map, so the pages of the file are shared by the processes and only read when used.
+# The files of a build are written in their own folder and the json file is replaced last, so the app never reads
+# a cache that is being written.
+# The alerts received later are added with ingest_file() : each batch is cleaned alone and written as a new table
+# of the cache, the tables already written are never changed.
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_name(path=file_path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def cache_meta_path(path=file_path, directory=cache_dir):
+    return os.path.join(directory, cache_name(path) + '.json')
+
+def read_cache_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_cache_meta(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+# The tables of the cache : the base (one table, or one by chunk when the file was streamed) then the added batches.
+def cache_tables(meta, directory=cache_dir):
+    return [os.path.join(directory, meta['tables'], table['file']) for table in meta['base'] + meta['parts']]
+
+def cache_is_valid(meta, directory=cache_dir):
+    return meta is not None and meta.get('format') == cache_format and all(os.path.exists(table) for table in cache_tables(meta, directory))
+
+def write_table(geo_data, data_path):
+    # Uncompressed Feather, in a single record batch, so that each column is read back as one array of the memory map.
+    tmp_path = data_path + '.tmp'
+    feather.write_feather(geo_data, tmp_path, compression='uncompressed', chunksize=max(len(geo_data), 1))
+    os.replace(tmp_path, data_path)
+
+def read_table(data_path):
+    # One block by column : pandas does not consolidate the columns in a new array and keeps the Arrow buffers.
+    return feather.read_table(data_path, memory_map=True).to_pandas(split_blocks=True)
+
+def load_tables(tables, directory=cache_dir, tables_dir=''):
+    return [read_table(os.path.join(directory, tables_dir, table['file'])) for table in tables]
+
+# Order of the rows of the index of the app (see vigicru_queries.IndexSegment), by the codes of the sorted values of
+# these columns. The tables of the cache are written in this order, so the index is built on them without sorting a copy.
+index_columns = ['Year', 'cdensup_1', 'NivInfViCr', 'CdDiEnt_1']
+
+def index_order(geo_data):
+    codes, categories = {}, {}
+    for column in index_columns:
+        codes[column], categories[column] = pd.factorize(geo_data[column], sort=True)
+    order = np.lexsort([codes[column] for column in reversed(index_columns)])
+    return codes, categories, order
+
+def sort_by_index(geo_data):
+    return geo_data.take(index_order(geo_data)[2]).reset_index(drop=True)
+
+# Write a table of the cache with the keys of its features.
+def write_cache_table(geo_data, keys, folder, name, **description):
+    geo_data = sort_by_index(geo_data)
+    write_table(geo_data, os.path.join(folder, name + '.feather'))
+    np.save(os.path.join(folder, name + '.keys.npy'), keys)
+    return {'file': name + '.feather', 'keys': name + '.keys.npy', 'features': len(keys), 'rows': len(geo_data), **description}
+
+# Key of each feature (river, date and geometry), used to skip the alerts that are already in the cache.
+def feature_keys(gdf):
+    keys = pd.DataFrame({
+        'LbEntCru': gdf['LbEntCru'].astype(str),
+        'DhCEntCru': pd.to_datetime(gdf['DhCEntCru']).astype(str),
+        'geometry': shapely.to_wkb(np.asarray(gdf.geometry), hex=True),
+    })
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+# Read the features of a GeoJSON file. With a batch size, the file is streamed by pyogrio as Arrow batches
+# of at most `batch_size` features instead of being read as a whole.
+def read_features(path, batch_size=None):
+    import geopandas as gpd
+    import pyogrio
+    if batch_size is None:
+        yield gpd.read_file(path)
+        return
+    with pyogrio.open_arrow(path, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        geometry_name = meta['geometry_name'] or 'wkb_geometry'
+        for batch in reader:
+            frame = batch.to_pandas()
+            geometry = shapely.from_wkb(frame.pop(geometry_name).to_numpy())
+            yield gpd.GeoDataFrame(frame, geometry=geometry, crs=meta['crs'])
+
+# Return the sha256 of the source file, recomputing it only when the mtime or the size changed since the last build.
+def source_version(path=file_path, directory=cache_dir):
+    meta_path = cache_meta_path(path, directory)
+    stat = os.stat(path)
+    meta = read_cache_meta(meta_path)
+    if cache_is_valid(meta, directory):
+        if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+            return meta['sha256']
+        sha256 = file_sha256(path)
+        if meta['sha256'] == sha256:
+            # The file was touched but not modified : keep the cache and remember the new mtime.
+            meta['mtime_ns'], meta['size'] = stat.st_mtime_ns, stat.st_size
+            write_cache_meta(meta_path, meta)
+        return sha256
+    return file_sha256(path)
+
+# Version of the whole dataset : the source file and the number of batches added to it. It only changes when
+# the source file changes or when a batch really adds alerts, so it can be used as the key of the caches of the app.
+def cache_version(meta):
+    return f"{meta['sha256']}+{len(meta['parts'])}" if meta.get('parts') else meta['sha256']
+
+def data_version(path=file_path, directory=cache_dir, sha256=None):
+    sha256 = source_version(path, directory) if sha256 is None else sha256
+    meta = read_cache_meta(cache_meta_path(path, directory))
+    if meta is None or meta['sha256'] != sha256:
+        return sha256
+    return cache_version(meta)
+
+# Version of the dataset when the cache is valid and the source file still has the mtime and size of its build,
+# None otherwise. It never reads the source file, for the checks done on every request.
+def cached_version(path=file_path, directory=cache_dir):
+    meta = read_cache_meta(cache_meta_path(path, directory))
+    stat = os.stat(path)
+    if cache_is_valid(meta, directory) and meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return cache_version(meta)
+    return None
+
+# Build the base of the cache from the source file. The batches added before are dropped :
+# a new source file replaces the whole history.
+# With a batch size, the file is cleaned chunk by chunk and each chunk is written as its own table, so the memory
+# used depends on the size of the chunks and not on the size of the file.
+# With `workers`, each table is cleaned by a pool of processes (see clean_geo_data_parallel).
+def build_cache(path=file_path, directory=cache_dir, sha256=None, batch_size=None, workers=1):
+    meta_path = cache_meta_path(path, directory)
+    stat = os.stat(path)
+    if sha256 is None:
+        sha256 = file_sha256(path)
+    tables_dir = f'{cache_name(path)}.{sha256[:16]}'
+    folder = os.path.join(directory, tables_dir)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    palettes, base = {}, []
+    for number, gdf in enumerate(read_features(path, batch_size), 1):
+        keys = feature_keys(gdf)
+        base.append(write_cache_table(clean_geo_data_parallel(gdf, palettes, workers), keys, folder, f'base-{number:05d}'))
+        del gdf
+    previous = read_cache_meta(meta_path)
+    write_cache_meta(meta_path, {'source': os.path.abspath(path), 'format': cache_format, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256, 'tables': tables_dir, 'palettes': palettes, 'base': base, 'parts': []})
+    if previous is not None and previous.get('tables') not in (None, tables_dir):
+        shutil.rmtree(os.path.join(directory, previous['tables']), ignore_errors=True)
+    return sha256
+
+# Build the cache if it is missing or out of date and return its description.
+# The files bigger than `stream_threshold` bytes are streamed by chunks of `stream_batch_size` features.
+# The sha256 of the source file can be given when it was just computed, so that the file is not read twice.
+stream_threshold = 256 * 2**20
+stream_batch_size = 50000
+
+def update_cache(path=file_path, directory=cache_dir, batch_size=None, workers=1, sha256=None):
+    meta_path = cache_meta_path(path, directory)
+    sha256 = source_version(path, directory) if sha256 is None else sha256
+    meta = read_cache_meta(meta_path)
+    if not cache_is_valid(meta, directory) or meta['sha256'] != sha256:
+        if batch_size is None and os.path.getsize(path) > stream_threshold:
+            batch_size = stream_batch_size
+        os.makedirs(directory, exist_ok=True)
+        build_cache(path, directory, sha256, batch_size, workers)
+        meta = read_cache_meta(meta_path)
+    return meta
+
+# Base of the cache as one table. The chunks of a streamed build are put back together (categories, then order of the
+# rows) as if the whole file had been cleaned at once, so the table does not depend on the size of the chunks.
+# The app does not use it : it keeps the chunks as segments of its index (see vigicru_shared.load_shared_data).
+def load_base(meta, directory=cache_dir):
+    tables = load_tables(meta['base'], directory, meta['tables'])
+    if len(tables) == 1:
+        return tables[0]
+    return sort_by_index(join_partitions(tables))
+
+# Tables of the batches added after the first `start` ones.
+def load_parts(meta, start=0, directory=cache_dir):
+    return load_tables(meta['parts'][start:], directory, meta['tables'])
+
+# Load the cleaned dataset from the cache, building it first if it is missing or out of date.
+def load_clean_data(path=file_path, directory=cache_dir):
+    meta = update_cache(path, directory)
+    return concat_geo_data([load_base(meta, directory)] + load_parts(meta, 0, directory))
+
+# Add the alerts of a new GeoJSON file to the cache. Only the features that are not already in the cache are
+# cleaned and stored, so the cost depends on the size of the batch and not on the history.
+# Return the number of new features.
+def ingest_file(batch_path, path=file_path, directory=cache_dir, workers=1):
+    meta = update_cache(path, directory, workers=workers)
+    folder = os.path.join(directory, meta['tables'])
+    gdf = next(read_features(batch_path))
+    keys = feature_keys(gdf)
+    known = np.concatenate([np.load(os.path.join(folder, table['keys'])) for table in meta['base'] + meta['parts']])
+    new = ~np.isin(keys, known) & ~pd.Series(keys).duplicated().to_numpy()
+    if not new.any():
+        return 0
+    gdf, keys = gdf[new].reset_index(drop=True), keys[new]
+    geo_data = clean_geo_data_parallel(gdf, meta['palettes'], workers)
+    name = f"batch-{len(meta['parts']) + 1:05d}"
+    meta['parts'].append(write_cache_table(geo_data, keys, folder, name, source=os.path.abspath(batch_path), sha256=file_sha256(batch_path)))
+    write_cache_meta(cache_meta_path(path, directory), meta)
+    return int(new.sum())
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the cache of the cleaned InfoVigiCru dataset or add new alerts to it.')
+    parser.add_argument('batches', nargs='*', help='GeoJSON files of new alerts to add')
+    parser.add_argument('--source', default=file_path)
+    parser.add_argument('--cache-dir', default=cache_dir)
+    parser.add_argument('--batch-size', type=int, default=None, help='stream the source file by chunks of this number of features')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes cleaning the features (0 : one by CPU)')
+    args = parser.parse_args()
+    workers = args.workers or None
+    update_cache(args.source, args.cache_dir, args.batch_size, workers)
+    for batch in args.batches:
+        print(f'{batch} : {ingest_file(batch, args.source, args.cache_dir, workers)} new alerts')
+    print(f'version : {data_version(args.source, args.cache_dir)}')
@@ -0,0 +1,214 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from vigicru_data import concat_geo_data, index_columns, index_order
+
+
+# Aggregated cube of the alerts :
+# The charts of the "Analyse of the alert" page only need counts, so the points are counted once by
+# (basin, territory, river, year, month, level) and each chart sums the few rows it needs.
+cube_dimensions = ['CdDiEnt_1', 'cdensup_1', 'LbEntCru', 'Year', 'Month', 'NivInfViCr']
+
+def alert_cube(geo_data):
+    return geo_data.groupby(cube_dimensions, observed=True, sort=True).size().reset_index(name='Count')
+
+# Cube of two sets of alerts, from the cube of each set.
+def merge_cubes(cube, new_cube):
+    cubes = concat_geo_data([cube, new_cube])
+    return cubes.groupby(cube_dimensions, observed=True, sort=True)['Count'].sum().reset_index()
+
+# Sum the cube by the columns of `by`, keeping only the rows matching the filters (a value or a collection of values).
+def rollup(cube, by, **filters):
+    mask = pd.Series(True, index=cube.index)
+    for column, value in filters.items():
+        if isinstance(value, (list, set, tuple)):
+            mask &= cube[column].isin(value)
+        else:
+            mask &= cube[column] == value
+    return cube[mask].groupby(by, observed=True, sort=True)['Count'].sum().reset_index()
+
+# Value counts of two sets of alerts, from the counts of each set.
+def merge_counts(counts, new_counts):
+    return counts.add(new_counts, fill_value=0).astype('int64').sort_values(ascending=False)
+
+# Distinct rows of two sets of alerts, from the distinct rows of each set.
+def merge_unique(rows, new_rows):
+    return concat_geo_data([rows, new_rows]).drop_duplicates(ignore_index=True)
+
+
+# Index of the points for the filters of the widgets :
+# The table is sorted once by (Year, cdensup_1, NivInfViCr, CdDiEnt_1) and each key column is replaced by integer codes
+# (the tables of the cache are already written in this order, they are then used as they are).
+# A filter on a prefix of these columns (Year, or Year and territory...) is then a contiguous slice of the table found
+# with a binary search. For the other combinations (Year and level for example), the order of the rows by the
+# combined code is computed the first time and kept, so each lookup only costs the size of its result.
+# The alerts added later are indexed alone as new segments (see AlertIndex.append), so adding a batch does not sort the
+# whole history again.
+class IndexSegment:
+    key_columns = index_columns
+
+    def __init__(self, geo_data):
+        codes, self.categories, order = index_order(geo_data)
+        if np.all(order[1:] > order[:-1]) and geo_data.index.equals(pd.RangeIndex(len(geo_data))):
+            self.data, self.codes = geo_data, codes
+        else:
+            self.data = geo_data.take(order).reset_index(drop=True)
+            self.codes = {column: codes[column][order] for column in self.key_columns}
+        # Code of each value. A dict is used rather than Index.get_indexer, whose hash table is built on first use
+        # and is not safe to build from several threads at once.
+        self._lookup = {column: {value: code for code, value in enumerate(self.categories[column].tolist())} for column in self.key_columns}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    # Combined code of the given columns for each row, with the order of the rows by this code.
+    # It is computed once by combination of columns, under a lock as the index is shared by the sessions.
+    def _combined(self, columns):
+        with self._lock:
+            if columns not in self._keys:
+                shape = [len(self.categories[column]) for column in columns]
+                combined = np.ravel_multi_index([self.codes[column] for column in columns], shape)
+                if list(columns) == self.key_columns[:len(columns)]:
+                    order = None  # already sorted
+                else:
+                    order = np.argsort(combined, kind='stable')
+                    combined = combined[order]
+                self._keys[columns] = (shape, combined, order)
+            return self._keys[columns]
+
+    # Positions of the rows matching the filters (a value or a collection of values by column).
+    def positions(self, **filters):
+        columns = tuple(column for column in self.key_columns if column in filters)
+        unknown = set(filters) - set(columns)
+        if unknown:
+            raise KeyError(f'{sorted(unknown)} not in the indexed columns {self.key_columns}')
+        if not columns:
+            return np.arange(len(self.data))
+        wanted = []
+        for column in columns:
+            values = filters[column]
+            values = values if isinstance(values, (list, set, tuple)) else [values]
+            wanted.append(np.array([self._lookup[column].get(value, -1) for value in values], dtype=np.intp))
+        shape, combined, order = self._combined(columns)
+        grid = [codes.ravel() for codes in np.meshgrid(*wanted, indexing='ij')]
+        found = np.all([codes >= 0 for codes in grid], axis=0)
+        keys = np.unique(np.ravel_multi_index([codes[found] for codes in grid], shape))
+        starts = np.searchsorted(combined, keys, side='left')
+        stops = np.searchsorted(combined, keys, side='right')
+        if len(keys) == 1 and order is None:
+            return slice(starts[0], stops[0])
+        ranges = [np.arange(start, stop) for start, stop in zip(starts, stops)]
+        result = np.concatenate(ranges) if ranges else np.array([], dtype=np.intp)
+        return np.sort(result) if order is None else np.sort(order[result])
+
+    def select(self, **filters):
+        positions = self.positions(**filters)
+        if isinstance(positions, slice):
+            return self.data.iloc[positions]
+        return self.data.take(positions)
+
+
+# Index made of the segments of the base of the dataset (one, or one by chunk when the file was streamed) and one for
+# each batch added later. When too many batches were added, their segments are merged into a single one (the base is
+# never copied again). The whole table is never kept next to the segments : the pages use
+# select(), or tables computed by segment (see SharedData.merged).
+class AlertIndex:
+    key_columns = IndexSegment.key_columns
+    max_segments = 16
+
+    def __init__(self, geo_data=None, segments=None, base=None):
+        self.segments = [IndexSegment(geo_data)] if segments is None else segments
+        self.base = len(self.segments) if base is None else base  # number of segments of the base
+        self.categories = {}
+        for column in self.key_columns:
+            values = pd.Index(np.concatenate([np.asarray(segment.categories[column]) for segment in self.segments]))
+            self.categories[column] = values.unique().sort_values()
+
+    def __len__(self):
+        return sum(len(segment.data) for segment in self.segments)
+
+    # New index with the rows of `new_data` added, the current one is not modified (it can still be used by the sessions).
+    def append(self, new_data):
+        if len(new_data) == 0:
+            return self
+        added = self.segments[self.base:]
+        if len(added) >= self.max_segments:
+            added = [IndexSegment(concat_geo_data([segment.data for segment in added] + [new_data]))]
+        else:
+            added = added + [IndexSegment(new_data)]
+        return AlertIndex(segments=self.segments[:self.base] + added, base=self.base)
+
+    # First `n` rows, in the order of the segments.
+    def head(self, n):
+        frames = []
+        for segment in self.segments:
+            if n <= 0:
+                break
+            frames.append(segment.data.head(n))
+            n -= len(frames[-1])
+        return concat_geo_data(frames)
+
+    def select(self, **filters):
+        if len(self.segments) == 1:
+            return self.segments[0].select(**filters)
+        return concat_geo_data([segment.select(**filters) for segment in self.segments])
+
+
+# Spatial binning of the points for the maps :
+# Instead of sending every point to the browser, the points are counted in the cells of the web map tiles
+# (the quadtree of the Web Mercator projection). The level of the quadtree is chosen from the zoom of the map
+# so that a cell measures about `cell_pixels` on the screen, then lowered until there are at most `max_cells`
+# cells : the size of the figure no longer depends on the number of alerts.
+max_latitude = 85.05112878
+
+def tile_level(zoom, cell_pixels=1):
+    # At zoom z the world is 2**z tiles of 256 pixels wide.
+    return max(0, int(round(zoom + np.log2(256 / cell_pixels))))
+
+def mercator(longitude, latitude):
+    latitude = np.radians(np.clip(latitude, -max_latitude, max_latitude))
+    x = (np.asarray(longitude, dtype=np.float64) + 180) / 360
+    y = (1 - np.log(np.tan(latitude) + 1 / np.cos(latitude)) / np.pi) / 2
+    return np.clip(x, 0, 1 - 1e-12), np.clip(y, 0, 1 - 1e-12)
+
+def inverse_mercator(x, y):
+    longitude = x * 360 - 180
+    latitude = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y))))
+    return longitude, latitude
+
+# Count the points by cell of the quadtree level `level` (and by the columns of `by`). `aggregations` gives other
+# columns to compute, as {name: (column, 'sum' | 'min' | 'max')}, these functions can be applied again when the cells
+# are merged.
+def group_cells(cells, by, aggregations):
+    functions = {'Count': 'sum', **{name: function for name, (_, function) in aggregations.items()}}
+    return cells.groupby(['cell_x', 'cell_y', *by], observed=True, sort=False).agg(functions).reset_index()
+
+def cell_counts(points, level, by=(), **aggregations):
+    x, y = mercator(points['longitude'].to_numpy(), points['latitude'].to_numpy())
+    cells = pd.DataFrame({'cell_x': (x * 2**level).astype(np.int64), 'cell_y': (y * 2**level).astype(np.int64)})
+    for column in by:
+        cells[column] = points[column].array
+    for name, (column, _) in aggregations.items():
+        cells[name] = points[column].to_numpy()
+    cells['Count'] = 1
+    return group_cells(cells, list(by), aggregations)
+
+# Cells of two sets of points, from the cells of each set (at the same level).
+def merge_cells(cells, new_cells, by=(), **aggregations):
+    return group_cells(concat_geo_data([cells, new_cells]), list(by), aggregations)
+
+# Center of each cell, after merging the cells 4 by 4 (one level up in the quadtree) while there are too many of them.
+def cell_points(cells, level, by=(), max_cells=20000, **aggregations):
+    while len(cells) > max_cells and level > 0:
+        level -= 1
+        cells = group_cells(cells.assign(cell_x=cells['cell_x'] // 2, cell_y=cells['cell_y'] // 2), list(by), aggregations)
+    longitude, latitude = inverse_mercator((cells['cell_x'] + 0.5) / 2**level, (cells['cell_y'] + 0.5) / 2**level)
+    cells = cells.drop(columns=['cell_x', 'cell_y'])
+    cells.insert(0, 'latitude', latitude)
+    cells.insert(0, 'longitude', longitude)
+    return cells
+
+def spatial_bins(points, zoom, by=(), cell_pixels=1, max_cells=20000, **aggregations):
+    level = tile_level(zoom, cell_pixels)
+    return cell_points(cell_counts(points, level, by, **aggregations), level, by, max_cells, **aggregations)
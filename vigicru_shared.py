@@ -0,0 +1,100 @@
+import os
+import sys
+import threading
+from functools import reduce
+
+from vigicru_data import cache_dir, cache_version, cached_version, concat_geo_data, data_version, file_path, load_parts, load_tables, source_version, update_cache
+from vigicru_queries import AlertIndex, IndexSegment, alert_cube, merge_cubes
+
+
+# Dataset shared by all the sessions of the process :
+# The table and its index are loaded once by process (and extended when new alerts are added) and every session
+# receives the same objects. The tables derived from them (aggregated cube, tables of a page...) are computed the
+# first time a page needs them and kept with the data. The whole table is never built : the tables are computed by
+# segment of the index and merged, so that the alerts added later only extend them.
+# The app turns on the copy on write of pandas : the frames returned by the filters are then views of the shared table
+# and a session that modifies one gets its own copy, so the shared data is never duplicated or changed by a session.
+
+class SharedData:
+    def __init__(self, version, source, parts, index):
+        self.version = version
+        self.source = source  # sha256 of the source file
+        self.parts = parts  # number of batches added to it
+        self.index = index
+        self._derived = {}
+        self._merges = {}
+        self._lock = threading.Lock()
+
+    # Aggregated cube of the alerts, for the "Analyse of the alert" page.
+    @property
+    def cube(self):
+        return self.merged('cube', alert_cube, merge_cubes)
+
+    # Table computed by `function` the first time `name` is asked for this version of the data, then kept.
+    def derived(self, name, function):
+        if name not in self._derived:
+            with self._lock:
+                if name not in self._derived:
+                    self._derived[name] = function()
+        return self._derived[name]
+
+    # Table computed by `compute` on the rows of each segment of the index and combined by `merge`. It is kept for
+    # the next versions of the data : load_shared_data() only merges it with the table of the new alerts.
+    def merged(self, name, compute, merge):
+        if name not in self._derived:
+            with self._lock:
+                if name not in self._derived:
+                    self._derived[name] = reduce(merge, [compute(segment.data) for segment in self.index.segments])
+                    self._merges[name] = (compute, merge)
+        return self._derived[name]
+
+_lock = threading.Lock()
+_shared = {}
+
+# Load the data of the cache. When only new batches were added since `previous`, only these batches are read and
+# the index and the merged tables already computed of `previous` are extended with them.
+def load_shared_data(path=file_path, directory=cache_dir, previous=None, sha256=None):
+    meta = update_cache(path, directory, sha256=sha256)
+    version, parts = cache_version(meta), len(meta['parts'])
+    if previous is not None and previous.source == meta['sha256'] and previous.parts <= parts:
+        new_data = concat_geo_data(load_parts(meta, previous.parts, directory))
+        shared = SharedData(version, meta['sha256'], parts, previous.index.append(new_data))
+        with previous._lock:
+            merges = dict(previous._merges)
+        for name, (compute, merge) in merges.items():
+            shared._derived[name] = merge(previous._derived[name], compute(new_data)) if len(new_data) else previous._derived[name]
+            shared._merges[name] = (compute, merge)
+        return shared
+    # One segment by table of the cache (the chunks of the base, then the batches) : the tables are used as they are,
+    # without copy, even when a big file was streamed by chunks.
+    index = AlertIndex(segments=[IndexSegment(table) for table in load_tables(meta['base'], directory, meta['tables'])])
+    for part in load_parts(meta, 0, directory):
+        index = index.append(part)
+    return SharedData(version, meta['sha256'], parts, index)
+
+# Return the shared data for the current version of the dataset. The requests only compare the version of the cache
+# with the shared data; when they differ (or the source file changed), the file is hashed and loaded under the lock,
+# so the first concurrent requests wait for a single load instead of all reading the file. The previous version is
+# released when the data changes.
+def get_shared_data(path=file_path, directory=cache_dir):
+    shared = _shared.get(path)
+    if shared is not None and shared.version == cached_version(path, directory):
+        return shared
+    with _lock:
+        sha256 = source_version(path, directory)
+        version = data_version(path, directory, sha256)
+        shared = _shared.get(path)
+        if shared is None or shared.version != version:
+            shared = load_shared_data(path, directory, shared, sha256)
+            _shared[path] = shared
+        return shared
+
+# Resident memory of the process (current value on Linux, peak value elsewhere), in bytes.
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024